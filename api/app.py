@@ -1,8 +1,17 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse
+from typing import Literal
+from pydantic import BaseModel, model_validator
 from recommender.engine import Recommender
+from recommender.deadline import Deadline
+from recommender.store import RecommendationStore
 from graph.db import db
+from graph.events import EventLog, EventWriter
 
 app = FastAPI(title="Mental Health Companion Recommender")
 
@@ -14,7 +23,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-recommender = Recommender()
+# Overload protection: each /recommend call gets a deadline shared by its
+# graph, neural and explanation stages, and at most MAX_CONCURRENT_REQUESTS
+# run at once. Excess requests wait briefly, then get a fast 503.
+REQUEST_DEADLINE_S = float(os.getenv("RECOMMEND_DEADLINE_S", "0.8"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "32"))
+QUEUE_WAIT_S = 0.05
+limiter = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Precomputed results for known users (see recommender/materialize.py)
+store = RecommendationStore()
+DEFAULT_LIMIT = 5
+
+# Construction is cheap: the Neo4j driver and the embedding model are both
+# created lazily, and the model is warmed up in the background on startup.
+recommender = Recommender(lazy=True, max_concurrency=MAX_CONCURRENT_REQUESTS, store=store)
+warm_up_thread = None
+ACTIVITY_RETRY_S = 30.0
+# How often to check for a retrained embedding file to switch to
+EMBEDDING_RELOAD_S = float(os.getenv("EMBEDDING_RELOAD_S", "60"))
+
+def on_events_flushed(user_ids):
+    # The graph changed for these users: drop their precomputed results and
+    # stop trusting their trained vectors until the next build. A failure
+    # (e.g. the store is locked by materialize) makes the writer retry the
+    # batch, so one step failing must not skip the other.
+    try:
+        store.invalidate(user_ids)
+    finally:
+        recommender.mark_stale(user_ids)
+
+# Write-behind ingestion of live user events (see POST /events)
+event_writer = EventWriter(
+    EventLog(os.getenv("EVENT_LOG_PATH", "data/events.log")),
+    on_flush=on_events_flushed,
+    batch_size=int(os.getenv("EVENT_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("EVENT_FLUSH_INTERVAL_S", "2.0"))
+)
 
 class RecommendationRequest(BaseModel):
     user_id: str = None
@@ -32,14 +77,92 @@ class RecommendationResponse(BaseModel):
     category: str
     explanation: str
 
+def warm_up():
+    try:
+        # Neural results stay empty until the activity catalogue is cached,
+        # so keep retrying while Neo4j is unreachable.
+        while not recommender.warm_up():
+            time.sleep(ACTIVITY_RETRY_S)
+        recommender.forget_older_builds()
+    except Exception as e:
+        print(f"Model warm-up failed: {e}")
+
+    # Pick up new builds, so rows materialised for them start being served
+    while True:
+        time.sleep(EMBEDDING_RELOAD_S)
+        try:
+            recommender.reload_if_changed()
+        except Exception as e:
+            print(f"Embedding reload failed: {e}")
+
+# Survey answers a state event must carry (see Recommender.map_attributes_to_states)
+SURVEY_FIELDS = ['growing_stress', 'mood_swings', 'social_weakness', 'coping_struggles', 'work_interest']
+
+class Event(BaseModel):
+    type: Literal['state', 'feedback']  # survey answers or activity interaction
+    user_id: str
+    growing_stress: str = None
+    mood_swings: str = None
+    social_weakness: str = None
+    coping_struggles: str = None
+    work_interest: str = None
+    activity_id: str = None
+    rating: float = None
+    timestamp: str = None
+
+    @model_validator(mode='after')
+    def check_fields(self):
+        # A state event replaces the user's survey states, so a partial one
+        # would silently drop the answers it left out.
+        if self.type == 'state':
+            missing = [field for field in SURVEY_FIELDS if getattr(self, field) is None]
+            if missing:
+                raise ValueError(f"State events require every survey answer; missing: {', '.join(missing)}")
+        elif not self.activity_id:
+            raise ValueError("Feedback events require an activity_id.")
+        return self
+
+@app.on_event("startup")
+def startup_event():
+    global warm_up_thread
+    warm_up_thread = threading.Thread(target=warm_up, name="model-warm-up", daemon=True)
+    warm_up_thread.start()
+    event_writer.start()
+
 @app.on_event("shutdown")
 def shutdown_event():
+    event_writer.stop()
     db.close()
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Mental Health Companion Recommender API"}
 
+@app.get("/healthz")
+def liveness():
+    """
+    Liveness probe: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readiness():
+    """
+    Readiness probe: the embedding model and activity catalogue have been
+    loaded and Neo4j is reachable.
+    """
+    # A finished load attempt is not enough: the file may be missing or
+    # unreadable, and neural results stay empty until activities are cached.
+    model_ready = recommender.neural.matrix is not None and recommender.neural.activities is not None
+    db_ready = db.is_available()
+    ready = model_ready and db_ready
+    body = {
+        "status": "ready" if ready else "not ready",
+        "model": model_ready,
+        "database": db_ready
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
 @app.get("/graph-data")
 def get_graph_data():
     """
@@ -97,9 +220,76 @@ def get_graph_data():
         "links": links
     }
 
+@app.get("/metrics")
+def metrics():
+    """
+    Counters for stage timeouts, degraded responses, load shedding and
+    request coalescing.
+    """
+    return {
+        "recommender": dict(recommender.stats),
+        "single_flight": dict(recommender.inflight.stats),
+        "events": dict(event_writer.stats)
+    }
+
+@app.post("/events", status_code=202)
+def record_events(events: list[Event]):
+    """
+    Accept state updates and activity feedback. Events are written to a
+    local log and acknowledged; they reach Neo4j in batches shortly after.
+    """
+    # Reject feedback on unknown activities while the catalogue is cached;
+    # otherwise the write itself skips them.
+    activities = recommender.neural.activities
+    if activities is not None:
+        unknown = sorted({e.activity_id for e in events if e.type == 'feedback'} - set(activities))
+        if unknown:
+            raise HTTPException(status_code=422, detail=f"Unknown activity_id: {', '.join(unknown)}")
+
+    records = []
+    for event in events:
+        timestamp = event.timestamp or datetime.now(timezone.utc).isoformat()
+        if event.type == 'state':
+            attributes = {field: getattr(event, field) for field in SURVEY_FIELDS}
+            records.append({
+                'type': 'state',
+                'user_id': event.user_id,
+                'states': recommender.map_attributes_to_states(attributes),
+                'timestamp': timestamp
+            })
+        else:
+            records.append({
+                'type': 'feedback',
+                'user_id': event.user_id,
+                'activity_id': event.activity_id,
+                'rating': event.rating,
+                'timestamp': timestamp
+            })
+
+    if records:
+        event_writer.submit(records)
+    return {"accepted": len(records)}
+
 @app.post("/recommend", response_model=list[RecommendationResponse])
 def get_recommendations(request: RecommendationRequest):
+    if not limiter.acquire(timeout=QUEUE_WAIT_S):
+        recommender.record('shed')
+        raise HTTPException(status_code=503, detail="Server is busy, please retry.", headers={"Retry-After": "1"})
+    try:
+        return recommend(request, Deadline(REQUEST_DEADLINE_S))
+    finally:
+        limiter.release()
+
+def recommend(request, deadline):
     # Core logic: Recommendations based on User Profile OR Dynamic Input
+
+    # Known users: serve the materialised result for the current build if present.
+    # Until warm-up has loaded the model the build is unknown, so go straight to
+    # the deadline-bounded live path rather than block on the load.
+    if request.user_id and recommender.neural.loaded:
+        cached = store.get(request.user_id, request.strategy, DEFAULT_LIMIT, recommender.neural.build_version)
+        if cached is not None:
+            return cached
     
     attributes = {
         'growing_stress': request.growing_stress,
@@ -113,15 +303,23 @@ def get_recommendations(request: RecommendationRequest):
     recs = recommender.get_recommendations(
         user_id=request.user_id, 
         attributes=attributes if not request.user_id else None,
-        strategy=request.strategy
+        limit=DEFAULT_LIMIT,
+        strategy=request.strategy,
+        deadline=deadline
     )
+
+    explanations = {}
+    if request.user_id:
+        explanations = recommender.explain_recommendations(
+            [item['id'] for item in recs], request.user_id, deadline=deadline
+        )
     
     response = []
     for item in recs:
         # Explanation logic
         explanation = "Recommended based on your current inputs."
         if request.user_id:
-            explanation = recommender.explain_recommendation(item['id'], request.user_id)
+            explanation = explanations[item['id']]
         else:
              # Simple dynamic explanation
              cat = item['reason_category']
@@ -0,0 +1,49 @@
+import sys
+import os
+import json
+import statistics
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Runs in a fresh interpreter so every measurement is a true cold start.
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import api.app as app_module
+t1 = time.perf_counter()
+app_module.recommender.warm_up()
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_s': t1 - t0,
+    'warm_up_s': t2 - t1,
+    'sklearn_imported': 'sklearn' in sys.modules,
+    'neo4j_imported': 'neo4j' in sys.modules,
+}))
+"""
+
+def run_probe():
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    # The app prints progress messages; the measurement is the last line.
+    return json.loads(out.strip().splitlines()[-1])
+
+def benchmark_startup(runs=5):
+    print(f"=== Startup Benchmark ({runs} cold starts) ===")
+    samples = [run_probe() for _ in range(runs)]
+
+    for key in ['import_s', 'warm_up_s']:
+        values = [s[key] for s in samples]
+        print(f"{key:>10}: median {statistics.median(values) * 1000:.1f} ms "
+              f"(min {min(values) * 1000:.1f} ms, max {max(values) * 1000:.1f} ms)")
+
+    print(f"scikit-learn imported at boot: {samples[0]['sklearn_imported']}")
+    print(f"neo4j imported at boot: {samples[0]['neo4j_imported']}")
+    return samples
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    benchmark_startup(runs)
@@ -0,0 +1,251 @@
+import sys
+import os
+import json
+import math
+import time
+import argparse
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from graph.db import db
+from ml.graph_embedding import GraphLearner
+from ml.inference import NeuralRecommender
+from recommender.engine import interleave, USER_GRAPH_QUERY
+
+PROTOCOLS = ['states', 'interactions']
+
+def load_edges():
+    """
+    Fetch the labelled edges the recommender relies on from Neo4j.
+    """
+    experiences = [(r['user'], r['state']) for r in db.query(
+        "MATCH (u:User)-[:EXPERIENCES]->(s:State) RETURN u.id as user, s.name as state")]
+    treats = [(r['activity'], r['state']) for r in db.query(
+        "MATCH (a:Activity)-[:TREATS]->(s:State) RETURN a.id as activity, s.name as state")]
+    interactions = [(r['user'], r['activity']) for r in db.query(
+        "MATCH (u:User)-[:INTERACTED]->(a:Activity) RETURN u.id as user, a.id as activity")]
+    return experiences, treats, interactions
+
+def holdout_split(pairs, fraction=0.2, seed=0):
+    """
+    For a sample of users with at least two (user, item) edges, hide one.
+    Returns {user: held_out_item}.
+    """
+    items_by_user = {}
+    for user, item in pairs:
+        items_by_user.setdefault(user, []).append(item)
+
+    candidates = sorted(u for u, items in items_by_user.items() if len(items) >= 2)
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(candidates, size=int(len(candidates) * fraction), replace=False) if candidates else []
+    return {str(user): str(rng.choice(sorted(items_by_user[user]))) for user in picked}
+
+def build_cases(protocol, experiences, treats, interactions, heldout):
+    """
+    Turn a holdout split into (user, relevant, excluded) evaluation cases and
+    the user -> visible states map the graph strategy may use.
+
+    states:       one EXPERIENCES edge is hidden. Relevant items are the
+                  activities treating the hidden state. Activities treating
+                  the user's visible states are removed from every ranked
+                  list, since each activity treats exactly one state and the
+                  question is whether a strategy surfaces the unreported need.
+                  The graph strategy can only return visible-state activities,
+                  so it is not scored under this protocol.
+    interactions: one INTERACTED edge (user feedback on an activity) is
+                  hidden; all states stay visible. The relevant item is the
+                  hidden activity; the user's other interacted activities are
+                  removed from every ranked list.
+    """
+    activities_by_state = {}
+    for activity, state in treats:
+        activities_by_state.setdefault(state, set()).add(activity)
+
+    visible_states = {}
+    for user, state in experiences:
+        if protocol != 'states' or heldout.get(user) != state:
+            visible_states.setdefault(user, []).append(state)
+
+    cases = []
+    if protocol == 'states':
+        for user, state in heldout.items():
+            excluded = set()
+            for visible in visible_states.get(user, []):
+                excluded |= activities_by_state.get(visible, set())
+            relevant = activities_by_state.get(state, set()) - excluded
+            if relevant:
+                cases.append((user, relevant, excluded))
+    else:
+        interacted = {}
+        for user, activity in interactions:
+            interacted.setdefault(user, set()).add(activity)
+        for user, activity in heldout.items():
+            cases.append((user, {activity}, interacted[user] - {activity}))
+    return cases, visible_states
+
+def precision_recall_ndcg(ranked_ids, relevant, k):
+    hits = [1 if item in relevant else 0 for item in ranked_ids[:k]]
+    dcg = sum(h / math.log2(i + 2) for i, h in enumerate(hits))
+    idcg = sum(1 / math.log2(i + 2) for i in range(min(len(relevant), k)))
+    return sum(hits) / k, sum(hits) / len(relevant), dcg / idcg if idcg else 0.0
+
+class OfflineRecommender:
+    """
+    Mirrors Recommender.get_recommendations() against the in-memory training
+    graph, so held-out edges in Neo4j cannot leak into the results.
+    """
+    def __init__(self, visible_states, treats, neural=None):
+        self.visible_states = visible_states
+        self.neural = neural
+        self.activities_by_state = {}
+        for activity, state in treats:
+            self.activities_by_state.setdefault(state, []).append(activity)
+        self.activity_ids = {activity for activity, _ in treats}
+
+    def graph(self, user_id, limit):
+        recs = []
+        for state in self.visible_states.get(user_id, []):
+            recs.extend({'id': a} for a in self.activities_by_state.get(state, []))
+        return recs[:limit]
+
+    def neural_recs(self, user_id, limit):
+        if self.neural is None or not self.neural.has_vector(user_id):
+            return []
+        # Score only the activities, as NeuralRecommender.predict() does
+        rows = np.array([self.neural.index[a] for a in self.activity_ids if self.neural.has_vector(a)],
+                        dtype=np.int64)
+        order, _ = self.neural.rank(self.neural.vector(user_id), rows)
+        return [{'id': self.neural.keys[idx]} for idx in order[:limit]]
+
+    def recommend(self, user_id, strategy, limit):
+        if strategy == 'graph':
+            return self.graph(user_id, limit)
+        if strategy == 'neural':
+            return self.neural_recs(user_id, limit)
+        return interleave(self.graph(user_id, limit), self.neural_recs(user_id, limit), limit)
+
+def score_strategy(recommender, cases, strategy, k):
+    precisions, recalls, ndcgs, latencies = [], [], [], []
+    for user_id, relevant, excluded in cases:
+        start = time.perf_counter()
+        # Over-fetch so that k items remain after removing excluded ones
+        recs = recommender.recommend(user_id, strategy, k + len(excluded))
+        latencies.append(time.perf_counter() - start)
+
+        ranked = [item['id'] for item in recs if item['id'] not in excluded][:k]
+        p, r, n = precision_recall_ndcg(ranked, relevant, k)
+        precisions.append(p)
+        recalls.append(r)
+        ndcgs.append(n)
+
+    return {
+        f'precision@{k}': float(np.mean(precisions)),
+        f'recall@{k}': float(np.mean(recalls)),
+        f'ndcg@{k}': float(np.mean(ndcgs)),
+        # In-memory scoring only; the live Neo4j graph query is timed separately
+        'score_ms_mean': float(np.mean(latencies) * 1000),
+        'score_ms_p95': float(np.percentile(latencies, 95) * 1000),
+        'users': len(latencies),
+    }
+
+def time_graph_queries(user_ids, k):
+    """
+    Latency of the live graph stage (USER_GRAPH_QUERY against Neo4j).
+    """
+    latencies = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        db.query(USER_GRAPH_QUERY, {'uid': user_id, 'limit': k})
+        latencies.append(time.perf_counter() - start)
+    return {
+        'neo4j_graph_ms_mean': float(np.mean(latencies) * 1000),
+        'neo4j_graph_ms_p95': float(np.percentile(latencies, 95) * 1000),
+    }
+
+def run_harness(dimensions=(8, 16, 32, 64), quantizations=('float', 'int8', 'pq'),
+                k=5, holdout=0.2, seed=0, protocol='states'):
+    """
+    Hold out edges (see build_cases() for the protocols), retrain the
+    embeddings without them and score every strategy / embedding
+    configuration. Cost (training time, index size, per-query scoring
+    latency) is recorded next to each score, and the live Neo4j graph query
+    is timed separately.
+    """
+    print(f"=== Offline Evaluation Harness (protocol: {protocol}) ===")
+    experiences, treats, interactions = load_edges()
+    pairs = experiences if protocol == 'states' else interactions
+    heldout = holdout_split(pairs, holdout, seed)
+    cases, visible_states = build_cases(protocol, experiences, treats, interactions, heldout)
+    print(f"{len(pairs)} {'EXPERIENCES' if protocol == 'states' else 'INTERACTED'} edges, "
+          f"{len(heldout)} held out, {len(cases)} evaluation cases.")
+    if not cases:
+        print("Nothing to evaluate.")
+        return {'protocol': protocol, 'results': [], 'graph_query': None}
+
+    # Full graph from Neo4j minus the held-out edges
+    learner = GraphLearner()
+    learner.fetch_graph_data()
+    learner.graph.remove_edges_from(list(heldout.items()))
+
+    results = []
+    if protocol != 'states':
+        graph_only = OfflineRecommender(visible_states, treats)
+        results.append({'strategy': 'graph', 'dimensions': None, 'quantization': None,
+                        'train_s': 0.0, 'index_kib': 0.0,
+                        **score_strategy(graph_only, cases, 'graph', k)})
+
+    for dims in dimensions:
+        start = time.perf_counter()
+        learner.train_embeddings(dimensions=dims)
+        train_s = time.perf_counter() - start
+        if not learner.vectors:
+            continue
+
+        for mode in quantizations:
+            neural = NeuralRecommender(lazy=True, quantization=mode)
+            start = time.perf_counter()
+            neural.set_vectors(learner.vectors)
+            index_s = time.perf_counter() - start
+
+            offline = OfflineRecommender(visible_states, treats, neural)
+            for strategy in ['neural', 'hybrid']:
+                results.append({'strategy': strategy, 'dimensions': dims, 'quantization': mode,
+                                'train_s': train_s + index_s,
+                                'index_kib': neural.index_bytes() / 1024,
+                                **score_strategy(offline, cases, strategy, k)})
+
+    graph_timing = time_graph_queries([user for user, _, _ in cases], k)
+    print_results(results, k, graph_timing)
+    return {'protocol': protocol, 'results': results, 'graph_query': graph_timing}
+
+def print_results(results, k, graph_timing):
+    header = (f"{'strategy':<8} {'dims':>5} {'quant':>6} {'P@k':>6} {'R@k':>6} {'NDCG@k':>7} "
+              f"{'train s':>8} {'index KiB':>10} {'score ms':>9} {'p95 ms':>7}")
+    print(f"\nk={k} (score ms = in-memory scoring only, excludes Neo4j)")
+    print(header)
+    for row in results:
+        print(f"{row['strategy']:<8} {str(row['dimensions'] or '-'):>5} {str(row['quantization'] or '-'):>6} "
+              f"{row[f'precision@{k}']:>6.3f} {row[f'recall@{k}']:>6.3f} {row[f'ndcg@{k}']:>7.3f} "
+              f"{row['train_s']:>8.2f} {row['index_kib']:>10.1f} "
+              f"{row['score_ms_mean']:>9.3f} {row['score_ms_p95']:>7.3f}")
+    print(f"\nLive Neo4j graph query (USER_GRAPH_QUERY): mean {graph_timing['neo4j_graph_ms_mean']:.2f} ms, "
+          f"p95 {graph_timing['neo4j_graph_ms_p95']:.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline recommendation quality-vs-cost evaluation")
+    parser.add_argument("--protocol", choices=PROTOCOLS, default='states',
+                        help="hold out EXPERIENCES edges (states) or INTERACTED edges (interactions)")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--quantization", nargs="+", choices=['float', 'int8', 'pq'],
+                        default=['float', 'int8', 'pq'])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction of eligible users to hold out")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = run_harness(args.dimensions, args.quantization, args.k, args.holdout, args.seed, args.protocol)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
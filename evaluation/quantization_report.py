@@ -0,0 +1,77 @@
+import sys
+import os
+import pickle
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from ml.inference import NeuralRecommender
+
+MODES = ['float', 'int8', 'pq']
+
+def top_k(neural, node_id, k):
+    order, _ = neural.rank(neural.vector(node_id))
+    result = []
+    for idx in order:
+        if neural.keys[idx] != node_id:
+            result.append(neural.keys[idx])
+        if len(result) >= k:
+            break
+    return result
+
+def quantization_report(embedding_path="data/graph_embeddings.pkl", k=10, queries=200, rerank=50):
+    """
+    Compare recall@k and latency of the quantised scoring paths against the
+    exact float path, using User nodes as queries and ranking all nodes.
+    Quantised modes re-rank their top `rerank` candidates against float16
+    copies of the vectors.
+    """
+    with open(embedding_path, 'rb') as f:
+        vectors = pickle.load(f)
+    # Memory the original float64 dict + matrix representation would use
+    dimensions = len(next(iter(vectors.values())))
+    baseline_bytes = 2 * len(vectors) * dimensions * 8
+
+    query_ids = [key for key in vectors if str(key).startswith('U')] or list(vectors)
+    rng = np.random.default_rng(0)
+    query_ids = list(rng.choice(query_ids, size=min(queries, len(query_ids)), replace=False))
+
+    print(f"=== Quantisation Report ({len(vectors)} nodes, {dimensions} dims, "
+          f"{len(query_ids)} queries, k={k}, rerank={rerank}) ===")
+    print(f"float64 dict + matrix baseline: {baseline_bytes / 1024:.1f} KiB")
+
+    exact = None
+    rows = []
+    for mode in MODES:
+        neural = NeuralRecommender(embedding_path, lazy=True, quantization=mode, rerank=rerank)
+        start = time.perf_counter()
+        neural.set_vectors(vectors)
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = {node_id: top_k(neural, node_id, k) for node_id in query_ids}
+        latency_ms = (time.perf_counter() - start) / len(query_ids) * 1000
+
+        if exact is None:
+            exact = results
+        recall = np.mean([len(set(results[q]) & set(exact[q])) / len(exact[q])
+                          for q in query_ids if exact[q]])
+
+        rows.append({
+            'mode': mode,
+            'recall_at_k': float(recall),
+            'index_kib': neural.index_bytes() / 1024,
+            'reduction': baseline_bytes / neural.index_bytes(),
+            'build_s': build_s,
+            'query_ms': latency_ms,
+        })
+
+    print(f"{'mode':<6} {'recall@k':>9} {'index KiB':>10} {'vs base':>8} {'build s':>8} {'query ms':>9}")
+    for row in rows:
+        print(f"{row['mode']:<6} {row['recall_at_k']:>9.3f} {row['index_kib']:>10.1f} "
+              f"{row['reduction']:>7.1f}x {row['build_s']:>8.3f} {row['query_ms']:>9.3f}")
+    return rows
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/graph_embeddings.pkl"
+    quantization_report(path)
@@ -1,5 +1,5 @@
-from neo4j import GraphDatabase
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,20 +10,60 @@ class Neo4jConnection:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(Neo4jConnection, cls).__new__(cls)
-            uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-            user = os.getenv("NEO4J_USER", "neo4j")
-            password = os.getenv("NEO4J_PASSWORD", "password")
-            cls._instance.driver = GraphDatabase.driver(uri, auth=(user, password))
+            # The driver is created on first use so that importing this module
+            # (and everything that depends on it) stays cheap.
+            cls._instance._driver = None
+            cls._instance._lock = threading.Lock()
         return cls._instance
 
+    @property
+    def driver(self):
+        if self._driver is None:
+            with self._lock:
+                if self._driver is None:
+                    from neo4j import GraphDatabase
+                    uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+                    user = os.getenv("NEO4J_USER", "neo4j")
+                    password = os.getenv("NEO4J_PASSWORD", "password")
+                    self._driver = GraphDatabase.driver(uri, auth=(user, password))
+        return self._driver
+
     def close(self):
-        if self.driver:
-            self.driver.close()
+        if self._driver:
+            self._driver.close()
+            self._driver = None
+
+    def is_available(self):
+        """
+        Check that the database can be reached (used by readiness probes).
+        """
+        try:
+            self.driver.verify_connectivity()
+            return True
+        except Exception:
+            return False
 
-    def query(self, query, parameters=None):
+    def query(self, query, parameters=None, timeout=None):
+        """
+        Run a query and return its records as dicts. `timeout` (seconds) is
+        sent as the transaction timeout so the server aborts slow queries.
+        """
+        if timeout is not None:
+            from neo4j import Query
+            query = Query(query, timeout=max(timeout, 0.001))
         with self.driver.session() as session:
             result = session.run(query, parameters)
             return [record.data() for record in result]
 
-# Global instance
+    def write(self, query, parameters=None):
+        """
+        Run a write query in a managed transaction (retried on transient errors)
+        and return its records as dicts.
+        """
+        def work(tx):
+            return [record.data() for record in tx.run(query, parameters)]
+        with self.driver.session() as session:
+            return session.execute_write(work)
+
+# Global instance (no connection is opened until the first query)
 db = Neo4jConnection()
@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+import time
+from graph.db import db
+
+# States derived from the survey answers. A state event replaces only these;
+# others (e.g. Isolation, set by the graph builder) are left alone.
+SURVEY_STATES = ['Stress', 'MoodSwings', 'SocialWeakness', 'CopingIssues', 'WorkBurnout']
+
+STATE_UPDATE_QUERY = """
+UNWIND $rows AS row
+MERGE (u:User {id: row.user_id})
+WITH u, row
+OPTIONAL MATCH (u)-[old:EXPERIENCES]->(s:State)
+WHERE s.name IN $survey_states
+DELETE old
+WITH DISTINCT u, row
+UNWIND row.states AS state
+MERGE (s:State {name: state})
+MERGE (u)-[:EXPERIENCES]->(s)
+"""
+
+# The activity is matched first so a row naming an unknown activity writes nothing
+FEEDBACK_QUERY = """
+UNWIND $rows AS row
+MATCH (a:Activity {id: row.activity_id})
+MERGE (u:User {id: row.user_id})
+MERGE (u)-[r:INTERACTED]->(a)
+SET r.rating = row.rating, r.timestamp = row.timestamp
+RETURN DISTINCT u.id AS user_id
+"""
+
+class EventLog:
+    """
+    Append-only JSON-lines log of ingested events. Events are fsynced before
+    they are acknowledged; a separate offset file records how far the log
+    has been written to Neo4j, so unflushed events are replayed on restart.
+    """
+    def __init__(self, path="data/events.log"):
+        self.path = path
+        self.offset_path = path + ".offset"
+
+    def append(self, events):
+        """
+        Durably append events. Returns the log offset just past each one.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        offsets = []
+        with open(self.path, 'ab') as f:
+            start = offset = f.seek(0, os.SEEK_END)
+            try:
+                for event in events:
+                    line = (json.dumps(event) + "\n").encode('utf-8')
+                    f.write(line)
+                    offset += len(line)
+                    offsets.append(offset)
+                f.flush()
+                os.fsync(f.fileno())
+            except Exception:
+                # Nothing was acknowledged; don't leave a partial line behind
+                f.truncate(start)
+                raise
+        return offsets
+
+    def repair(self):
+        """
+        Cut off a torn final line left by a crash mid-append, so the next
+        append starts on a fresh line. That line was never acknowledged.
+        """
+        if not os.path.exists(self.path):
+            return
+        offset = self.committed_offset()
+        with open(self.path, 'r+b') as f:
+            f.seek(offset)
+            data = f.read()
+            end = offset + data.rfind(b"\n") + 1
+            if end < offset + len(data):
+                print("Discarding a torn event log line.")
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def committed_offset(self):
+        if not os.path.exists(self.offset_path):
+            return 0
+        with open(self.offset_path, 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+
+    def commit(self, offset):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def read_uncommitted(self):
+        """
+        (event, end offset) pairs for the events appended after the
+        committed offset.
+        """
+        if not os.path.exists(self.path):
+            return []
+        offset = self.committed_offset()
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+
+        events = []
+        for line in data.splitlines(keepends=True):
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                events.append((json.loads(line), offset))
+            except ValueError:
+                print("Skipping unreadable event log line.")
+        return events
+
+    def truncate(self):
+        """
+        Start a new log once every event in it has been flushed. The offset
+        is reset first: a crash in between replays already-written events
+        (the writes are idempotent) rather than skipping new ones.
+        """
+        self.commit(0)
+        open(self.path, 'w').close()
+
+class EventWriter:
+    """
+    Write-behind ingestion: events are appended to the local log and
+    acknowledged immediately, then written to Neo4j in UNWIND transactions
+    of at most `batch_size` events when a batch is pending or
+    `flush_interval` seconds have passed. After a failed write the next
+    attempt is delayed with exponential backoff, up to `max_backoff`
+    seconds. `on_flush(user_ids)` is called after each batch is written so
+    caches for those users can be marked stale; the batch counts as flushed
+    only once it returns.
+    """
+    def __init__(self, log=None, on_flush=None, batch_size=500, flush_interval=2.0, max_backoff=60.0):
+        self.log = log or EventLog()
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        # (event, log offset just past it), oldest first
+        self.pending = []
+        self.stats = {'accepted': 0, 'flushed': 0, 'batches': 0, 'failed_batches': 0}
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        # Replay anything accepted but not yet written before a restart
+        with self._lock:
+            self.log.repair()
+            self.pending = self.log.read_uncommitted()
+        if self.pending:
+            print(f"Replaying {len(self.pending)} unflushed events.")
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def submit(self, events):
+        """
+        Durably record events; they reach Neo4j on the next flush.
+        """
+        with self._lock:
+            offsets = self.log.append(events)
+            self.pending.extend(zip(events, offsets))
+            self.stats['accepted'] += len(events)
+            if len(self.pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            with self._lock:
+                while not self._stopping:
+                    now = time.monotonic()
+                    if now < self._retry_at:
+                        # Backing off after a failed write
+                        self._wakeup.wait(timeout=self._retry_at - now)
+                    elif len(self.pending) >= self.batch_size or now >= next_flush:
+                        break
+                    else:
+                        self._wakeup.wait(timeout=next_flush - now)
+                if self._stopping:
+                    return
+            self.flush()
+            next_flush = time.monotonic() + self.flush_interval
+
+    def flush(self):
+        """
+        Write pending events to Neo4j, `batch_size` at a time, committing the
+        log offset after each batch. Stops at the first failed batch.
+
+        The offset is committed only once `on_flush` has succeeded too; if it
+        fails the batch is retried (the writes are idempotent), so cache
+        invalidation is never lost once the events are acknowledged.
+        """
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self.pending:
+                        return
+                    chunk = self.pending[:self.batch_size]
+                batch = [event for event, _ in chunk]
+                end_offset = chunk[-1][1]
+
+                try:
+                    user_ids = self._write(batch)
+                    if self.on_flush:
+                        self.on_flush(user_ids)
+                except Exception as e:
+                    with self._lock:
+                        self.stats['failed_batches'] += 1
+                        self._failures += 1
+                        backoff = min(self.flush_interval * 2 ** (self._failures - 1), self.max_backoff)
+                        self._retry_at = time.monotonic() + backoff
+                    print(f"Event flush failed, retrying in {backoff:.1f}s: {e}")
+                    return
+
+                with self._lock:
+                    del self.pending[:len(chunk)]
+                    self._failures = 0
+                    self._retry_at = 0.0
+                    self.log.commit(end_offset)
+                    # Nothing left unflushed: start a fresh log rather than grow forever
+                    if not self.pending and self.log.size() == end_offset:
+                        self.log.truncate()
+                    self.stats['flushed'] += len(batch)
+                    self.stats['batches'] += 1
+
+    def _write(self, batch):
+        # A state update replaces the user's states, so only the latest one counts
+        latest_states = {}
+        feedback = []
+        for event in batch:
+            if event['type'] == 'state':
+                latest_states[event['user_id']] = {'user_id': event['user_id'], 'states': event['states']}
+            elif event['type'] == 'feedback':
+                feedback.append({
+                    'user_id': event['user_id'],
+                    'activity_id': event['activity_id'],
+                    'rating': event.get('rating'),
+                    'timestamp': event.get('timestamp')
+                })
+
+        user_ids = set(latest_states)
+        if latest_states:
+            db.write(STATE_UPDATE_QUERY, {'rows': list(latest_states.values()), 'survey_states': SURVEY_STATES})
+        if feedback:
+            # Only users whose feedback matched an activity were changed
+            rows = db.write(FEEDBACK_QUERY, {'rows': feedback})
+            user_ids.update(row['user_id'] for row in rows)
+        return user_ids
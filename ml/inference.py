@@ -1,60 +1,217 @@
 import pickle
+import hashlib
 import os
 import sys
+import threading
+import time
 
 # Add project root to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from graph.db import db
+from ml.quantization import make_quantizer
 
 class NeuralRecommender:
-    def __init__(self, embedding_path="data/graph_embeddings.pkl"):
-        self.vectors = None
+    def __init__(self, embedding_path="data/graph_embeddings.pkl", lazy=False,
+                 quantization=None, rerank=50):
         self.keys = []
+        self.index = {}
         self.matrix = None
+        self.norms = None
+        self.quantizer = None
+        self.build_version = None
+        # (mtime, size) of the embedding file when it was loaded
+        self.file_stat = None
         self.embedding_path = embedding_path
-        self.load_model()
+        # 'float' (exact), 'int8' (scalar) or 'pq' (product quantisation).
+        # Quantised modes score candidates approximately, then re-rank the
+        # top `rerank` of them against float16 copies of the vectors.
+        self.quantization = quantization or os.getenv("EMBEDDING_QUANTIZATION", "float")
+        self.rerank = rerank
+        # Activity details keyed by id, so filtering candidates does not need
+        # a database round trip per node (None until loaded).
+        self.activities = None
+        self._activities_retry_at = 0.0
+        self._activities_lock = threading.Lock()
+        self._activity_rows = None
+        self.loaded = False
+        self._load_lock = threading.Lock()
+        if not lazy:
+            self.load_model()
+
+    def ensure_loaded(self):
+        """
+        Load the embeddings on first use. Safe to call from several threads;
+        only the first caller pays the unpickling cost.
+        """
+        if not self.loaded:
+            with self._load_lock:
+                if not self.loaded:
+                    self.load_model()
+
+    def ensure_activities(self, retry_interval=30.0):
+        """
+        Cache the Activity catalogue in memory. If Neo4j is unavailable the
+        load is retried at most every `retry_interval` seconds; until then
+        neural predictions are empty. Returns whether the catalogue is cached.
+        """
+        if self.activities is not None or time.monotonic() < self._activities_retry_at:
+            return self.activities is not None
+        # Another thread is already loading; don't queue up behind it.
+        if not self._activities_lock.acquire(blocking=False):
+            return False
+        try:
+            if self.activities is not None:
+                return True
+            try:
+                query = """
+                MATCH (a:Activity)
+                RETURN a.id as id, a.name as title, a.type as type, 'Activity' as category
+                """
+                self.activities = {row['id']: row for row in db.query(query)}
+                self._activity_rows = None
+                print(f"Cached {len(self.activities)} activities.")
+            except Exception as e:
+                self._activities_retry_at = time.monotonic() + retry_interval
+                print(f"Failed to cache activities: {e}")
+        finally:
+            self._activities_lock.release()
+        return self.activities is not None
 
     def load_model(self):
         if os.path.exists(self.embedding_path):
             try:
                 with open(self.embedding_path, 'rb') as f:
-                    self.vectors = pickle.load(f)
-                
-                # Pre-process for fast similarity
-                self.keys = list(self.vectors.keys())
-                self.matrix = np.array([self.vectors[k] for k in self.keys])
+                    stat = os.fstat(f.fileno())
+                    self.file_stat = (stat.st_mtime_ns, stat.st_size)
+                    data = f.read()
+                # Identifies the graph/embedding build these vectors came from.
+                self.build_version = hashlib.sha1(data).hexdigest()[:16]
+                self.set_vectors(pickle.loads(data))
                 
-                print(f"Loaded embeddings for {len(self.vectors)} nodes.")
+                print(f"Loaded embeddings for {len(self.keys)} nodes ({self.quantization}).")
             except Exception as e:
                 print(f"Failed to load embeddings: {e}")
         else:
             print(f"Embedding file not found at {self.embedding_path}")
+        self.loaded = True
+
+    def file_changed(self):
+        """
+        Whether the embedding file on disk differs from the loaded one.
+        """
+        if not self.loaded or not os.path.exists(self.embedding_path):
+            return False
+        stat = os.stat(self.embedding_path)
+        return (stat.st_mtime_ns, stat.st_size) != self.file_stat
+
+    def set_vectors(self, vectors):
+        """
+        Build the similarity index from a {node_id: vector} dict.
+        The vectors are held once, as rows of a single matrix.
+        """
+        keys = list(vectors.keys())
+        matrix = np.array([vectors[k] for k in keys], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+
+        quantizer = None
+        if self.quantization != 'float':
+            quantizer = make_quantizer(self.quantization).fit(matrix / norms[:, None])
+            # The rows are only used to re-rank the shortlist (and to build
+            # query vectors), so they are kept at half precision.
+            matrix = matrix.astype(np.float16)
+
+        self.keys = keys
+        self.index = {k: i for i, k in enumerate(keys)}
+        self.norms = norms
+        self.quantizer = quantizer
+        self.matrix = matrix
+        self._activity_rows = None
+
+    def has_vector(self, node_id):
+        return node_id in self.index
+
+    def vector(self, node_id):
+        return self.matrix[self.index[node_id]].astype(np.float32)
+
+    def index_bytes(self):
+        """
+        Memory held by the similarity index.
+        """
+        if self.matrix is None:
+            return 0
+        total = self.matrix.nbytes + self.norms.nbytes
+        if self.quantizer is not None:
+            total += self.quantizer.nbytes()
+        return total
+
+    def activity_rows(self):
+        """
+        Matrix rows of the cached Activity catalogue (None if not cached).
+        """
+        if self.activities is None:
+            return None
+        if self._activity_rows is None:
+            self._activity_rows = np.array(
+                [self.index[a] for a in self.activities if a in self.index], dtype=np.int64)
+        return self._activity_rows
+
+    def rank(self, vector, rows=None):
+        """
+        Rank nodes by cosine similarity to `vector`: every node, or only the
+        given matrix rows. Returns (row indices best-first, their scores).
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        if rows is None:
+            candidates = np.arange(len(self.keys))
+            matrix, norms = self.matrix, self.norms
+        else:
+            candidates = rows
+            matrix, norms = self.matrix[rows], self.norms[rows]
+
+        if self.quantizer is None:
+            scores = (matrix @ query) / norms
+            order = scores.argsort()[::-1]
+            return candidates[order], scores[order]
+
+        scores = self.quantizer.scores(query, rows)
+        order = scores.argsort()[::-1]
+        shortlist, rest = order[:self.rerank], order[self.rerank:]
+        refined = (matrix[shortlist].astype(np.float32) @ query) / norms[shortlist]
+        by_refined = refined.argsort()[::-1]
+        # Re-ranked shortlist first, then the rest in approximate order
+        order = np.concatenate([shortlist[by_refined], rest])
+        scores = np.concatenate([refined[by_refined], scores[rest]])
+        return candidates[order], scores
 
     def predict(self, user_id, limit=5):
         """
         Find activities most similar to the user's vector representation.
         """
-        if not self.vectors:
+        self.ensure_loaded()
+        # Without the activity catalogue every candidate would need its own
+        # database lookup, so return nothing until warm-up has cached it.
+        if self.matrix is None or self.activities is None:
             return []
         
-        if user_id not in self.vectors:
+        if not self.has_vector(user_id):
             return []
 
-        user_vector = self.vectors[user_id].reshape(1, -1)
+        user_vector = self.vector(user_id)
         
-        # Calculate similarity against all nodes
-        scores = cosine_similarity(user_vector, self.matrix)[0]
-        
-        # Get top indices
-        top_indices = scores.argsort()[::-1]
+        # Score the cached Activity catalogue, best first
+        top_indices, scores = self.rank(user_vector, self.activity_rows())
         
         recommendations = []
-        for idx in top_indices:
+        for idx, score in zip(top_indices, scores):
             node_id = self.keys[idx]
-            score = float(scores[idx])
+            score = float(score)
             
             if node_id == user_id:
                 continue
@@ -76,29 +233,29 @@ class NeuralRecommender:
         Generate recommendations for a user without history by averaging 
         the vectors of the States they describe.
         """
-        if not self.vectors:
+        self.ensure_loaded()
+        if self.matrix is None or self.activities is None:
             return []
 
         # 1. Collect vectors for all valid states
         state_vectors = []
         for state in distinct_states:
-            if state in self.vectors:
-                state_vectors.append(self.vectors[state])
+            if self.has_vector(state):
+                state_vectors.append(self.vector(state))
         
         if not state_vectors:
             return []
 
         # 2. Create Proxy User Vector (Mean of attributes)
-        proxy_vector = np.mean(state_vectors, axis=0).reshape(1, -1)
+        proxy_vector = np.mean(state_vectors, axis=0)
 
         # 3. Find similar activities
-        scores = cosine_similarity(proxy_vector, self.matrix)[0]
-        top_indices = scores.argsort()[::-1]
+        top_indices, scores = self.rank(proxy_vector, self.activity_rows())
 
         recommendations = []
-        for idx in top_indices:
+        for idx, score in zip(top_indices, scores):
             node_id = self.keys[idx]
-            score = float(scores[idx])
+            score = float(score)
 
             # Filter for Activities (exclude the very states we used)
             if node_id in distinct_states:
@@ -117,11 +274,7 @@ class NeuralRecommender:
 
     def get_activity_details(self, node_id):
         """
-        Check if node is Activity and get details.
-        """
-        query = """
-        MATCH (a:Activity {id: $aid})
-        RETURN a.id as id, a.name as title, a.type as type, 'Activity' as category
+        Check if node is Activity and get details (from the cached catalogue).
         """
-        result = db.query(query, {'aid': node_id})
-        return result[0] if result else None
+        details = (self.activities or {}).get(node_id)
+        return dict(details) if details else None
@@ -0,0 +1,125 @@
+import numpy as np
+
+class ScalarQuantizer:
+    """
+    int8 scalar quantisation with a symmetric per-dimension scale.
+    Uses 1 byte per dimension instead of 4 (float32) or 8 (float64).
+    """
+    def __init__(self, chunk_size=4096):
+        self.codes = None
+        self.scale = None
+        self.chunk_size = chunk_size
+
+    def fit(self, matrix):
+        scale = np.abs(matrix).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        self.codes = np.clip(np.rint(matrix / self.scale), -127, 127).astype(np.int8)
+        return self
+
+    def scores(self, query, rows=None):
+        """
+        Approximate dot products between query and the encoded rows
+        (all of them, or only the given row indices).
+        """
+        codes = self.codes if rows is None else self.codes[rows]
+        # Fold the scale into the query so the codes never need decoding as a
+        # whole; rows are upcast in chunks to bound temporary memory.
+        scaled_query = (query * self.scale).astype(np.float32)
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.chunk_size):
+            end = start + self.chunk_size
+            out[start:end] = codes[start:end].astype(np.float32) @ scaled_query
+        return out
+
+    def nbytes(self):
+        return self.codes.nbytes + self.scale.nbytes
+
+class ProductQuantizer:
+    """
+    Product quantisation: each vector is split into `subspaces` chunks and
+    each chunk is replaced by the id of its nearest k-means centroid, so a
+    vector costs one byte per subspace. Scoring uses per-query lookup tables
+    (asymmetric distance computation).
+    """
+    def __init__(self, subspaces=None, centroids=256, iterations=20, train_size=20000, seed=0):
+        self.subspaces = subspaces
+        self.centroids = centroids
+        self.train_size = train_size
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks = None
+        self.codes = None
+
+    @staticmethod
+    def _default_subspaces(dimensions):
+        # Largest divisor of the dimensionality giving >= 4 dims per subspace
+        for m in range(max(1, dimensions // 4), 0, -1):
+            if dimensions % m == 0:
+                return m
+        return 1
+
+    @staticmethod
+    def _assign(data, centers, chunk_size=4096):
+        labels = np.empty(len(data), dtype=np.int64)
+        center_norms = (centers ** 2).sum(axis=1)
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            # ||x - c||^2 without the per-row ||x||^2 term, which is constant for argmin
+            distances = center_norms[None, :] - 2 * chunk @ centers.T
+            labels[start:start + chunk_size] = distances.argmin(axis=1)
+        return labels
+
+    def _kmeans(self, data, k, rng):
+        centers = data[rng.choice(len(data), size=k, replace=False)].copy()
+        for _ in range(self.iterations):
+            labels = self._assign(data, centers)
+            counts = np.bincount(labels, minlength=k)
+            sums = np.stack([np.bincount(labels, weights=data[:, d], minlength=k)
+                             for d in range(data.shape[1])], axis=1)
+            # Empty clusters keep their previous centre
+            filled = counts > 0
+            centers[filled] = sums[filled] / counts[filled, None]
+        return centers
+
+    def fit(self, matrix):
+        n, dimensions = matrix.shape
+        m = self.subspaces or self._default_subspaces(dimensions)
+        if dimensions % m != 0:
+            raise ValueError(f"{dimensions} dimensions cannot be split into {m} subspaces")
+        self.subspaces = m
+        k = min(self.centroids, 256, n)
+        sub_dim = dimensions // m
+        rng = np.random.default_rng(self.seed)
+
+        # Codebooks are trained on a sample; every row is then encoded.
+        sample = rng.choice(n, size=min(n, self.train_size), replace=False)
+
+        self.codebooks = np.empty((m, k, sub_dim), dtype=np.float32)
+        self.codes = np.empty((n, m), dtype=np.uint8)
+        for j in range(m):
+            sub = matrix[:, j * sub_dim:(j + 1) * sub_dim].astype(np.float32)
+            self.codebooks[j] = self._kmeans(sub[sample], k, rng)
+            self.codes[:, j] = self._assign(sub, self.codebooks[j])
+        return self
+
+    def scores(self, query, rows=None):
+        codes = self.codes if rows is None else self.codes[rows]
+        m, k, sub_dim = self.codebooks.shape
+        query_parts = query.astype(np.float32).reshape(m, sub_dim)
+        # tables[j, c] = <query chunk j, centroid c of subspace j>
+        tables = np.einsum('mkd,md->mk', self.codebooks, query_parts)
+        return tables[np.arange(m), codes].sum(axis=1)
+
+    def nbytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes
+
+QUANTIZERS = {
+    'int8': ScalarQuantizer,
+    'pq': ProductQuantizer,
+}
+
+def make_quantizer(mode):
+    if mode not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization mode: {mode} (expected one of {list(QUANTIZERS)})")
+    return QUANTIZERS[mode]()
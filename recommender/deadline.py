@@ -0,0 +1,12 @@
+import time
+
+class Deadline:
+    """
+    Time budget for a single request, shared by all of its pipeline stages.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
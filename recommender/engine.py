@@ -1,98 +1,345 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as StageTimeout
 from graph.db import db
 from ml.inference import NeuralRecommender
+from recommender.singleflight import SingleFlight
+
+# Per-stage time budgets in seconds, each further capped by the request deadline
+STAGE_BUDGETS = {'graph': 0.3, 'neural': 0.3, 'explain': 0.2}
+
+USER_GRAPH_QUERY = """
+MATCH (u:User {id: $uid})-[:EXPERIENCES]->(s:State)<-[:TREATS]-(a:Activity)
+RETURN a.id as id, a.name as title, a.type as type, s.name as reason_category, 'Activity' as category
+LIMIT $limit
+"""
+
+STATES_GRAPH_QUERY = """
+MATCH (s:State)<-[:TREATS]-(a:Activity)
+WHERE s.name IN $states
+RETURN a.id as id, a.name as title, a.type as type, s.name as reason_category, 'Activity' as category
+LIMIT $limit
+"""
+
+def interleave(graph_recs, neural_recs, limit):
+    """
+    Combine and deduplicate graph and neural results.
+    Interleave results for hybrid feel (Graph, Neural, Graph, Neural...)
+    """
+    combined = []
+    seen = set()
+    
+    max_len = max(len(graph_recs), len(neural_recs))
+    for i in range(max_len):
+        if i < len(graph_recs):
+            item = graph_recs[i]
+            if item['id'] not in seen:
+                combined.append(item)
+                seen.add(item['id'])
+        
+        if i < len(neural_recs):
+            item = neural_recs[i]
+            if item['id'] not in seen:
+                combined.append(item)
+                seen.add(item['id'])
+                
+    return combined[:limit]
 
 class Recommender:
-    def __init__(self):
-        self.neural = NeuralRecommender()
+    def __init__(self, lazy=False, max_concurrency=32, store=None):
+        # lazy=True defers loading the embeddings until warm_up() or the first
+        # neural prediction, which keeps construction (and API import) cheap.
+        self.neural = NeuralRecommender(lazy=lazy)
+        if not lazy:
+            self.neural.ensure_activities()
+        self.inflight = SingleFlight()
+        # Database stages run here when a request carries a deadline, so a
+        # slow query can be abandoned instead of blocking the request. Each
+        # request has at most two database stages in flight at once.
+        self.executor = ThreadPoolExecutor(max_workers=2 * max_concurrency,
+                                           thread_name_prefix="recommender-stage")
+        # Last complete result per request key, served when every stage fails
+        self.last_good = OrderedDict()
+        self.last_good_size = 1024
+        self.stats = Counter()
+        # Persists which users' graph data changed (via /events) after the
+        # embeddings were trained; without a store nothing is tracked.
+        self.store = store
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """
+        Load the embedding model and activity catalogue ahead of the first request.
+        Returns False if the catalogue could not be cached yet.
+        """
+        self.neural.ensure_loaded()
+        return self.neural.ensure_activities()
+
+    def forget_older_builds(self):
+        """
+        Drop stale marks recorded against builds other than the one being
+        served. Called by the serving process once a build is in use, so
+        materialising a new build does not clear marks the old one needs.
+        """
+        if self.store is not None and self.neural.build_version:
+            self.store.clear_stale(self.neural.build_version)
+
+    def reload_if_changed(self):
+        """
+        Swap in a newly trained embedding build (e.g. after retraining and
+        materialising) without a restart. The new model is loaded alongside
+        the current one and replaces it in a single assignment, so requests
+        in flight keep a consistent view. Returns True if a build was swapped.
+        """
+        current = self.neural
+        if not current.file_changed():
+            return False
+        fresh = NeuralRecommender(current.embedding_path, quantization=current.quantization,
+                                  rerank=current.rerank)
+        # A half-written file fails to load; the next check tries again.
+        if fresh.matrix is None:
+            return False
+        if fresh.build_version == current.build_version:
+            # Rewritten with the same contents
+            current.file_stat = fresh.file_stat
+            return False
+        if not fresh.ensure_activities():
+            return False
+        self.neural = fresh
+        with self._lock:
+            self.last_good.clear()
+        self.forget_older_builds()
+        print(f"Switched to embedding build {fresh.build_version}.")
+        return True
 
-    def get_recommendations(self, user_id=None, attributes=None, limit=5, strategy='hybrid'):
+    def record(self, event):
+        with self._lock:
+            self.stats[event] += 1
+
+    def _stage_budget(self, stage, deadline):
+        if deadline is None:
+            return None
+        return min(STAGE_BUDGETS[stage], deadline.remaining())
+
+    def _run_stages(self, stages, deadline, inline=()):
+        """
+        Run {name: fn} stages. Without a deadline they run inline. With one,
+        database stages run concurrently on the executor while the in-memory
+        stages named in `inline` run on the calling thread; any stage that
+        fails or overruns its budget yields None (and is counted) instead of
+        a result.
+        """
+        if deadline is None:
+            return {name: fn() for name, fn in stages.items()}
+
+        started = time.monotonic()
+        futures = {name: self.executor.submit(fn) for name, fn in stages.items() if name not in inline}
+        results = {}
+        for name in inline:
+            if name in stages:
+                results[name] = self._call_stage(name, stages[name])
+        for name, future in futures.items():
+            expires = min(started + STAGE_BUDGETS[name], deadline.expires_at)
+            try:
+                results[name] = future.result(timeout=max(0.0, expires - time.monotonic()))
+            except StageTimeout:
+                # Frees the worker if the stage has not started yet; a running
+                # query is bounded by its own transaction timeout.
+                future.cancel()
+                self.record(f'{name}_timeout')
+                results[name] = None
+            except Exception as e:
+                print(f"Recommendation stage '{name}' failed: {e}")
+                self.record(f'{name}_error')
+                results[name] = None
+        return results
+
+    def _call_stage(self, name, fn):
+        try:
+            return fn()
+        except Exception as e:
+            print(f"Recommendation stage '{name}' failed: {e}")
+            self.record(f'{name}_error')
+            return None
+
+    def mark_stale(self, user_ids):
+        """
+        New events for these users have reached the graph: their trained
+        vectors no longer match their states and remembered results are out
+        of date. Their neural results come from their current states instead
+        until the embeddings are retrained.
+        """
+        with self._lock:
+            for key in [k for k in self.last_good if k[0] == 'user' and k[1] in user_ids]:
+                del self.last_good[key]
+        if self.store is not None:
+            self.neural.ensure_loaded()
+            if self.neural.build_version:
+                self.store.mark_stale(user_ids, self.neural.build_version)
+
+    def is_stale(self, user_id):
+        if self.store is None:
+            return False
+        return self.store.is_stale(user_id, self.neural.build_version)
+
+    def _predict_from_current_states(self, user_id, limit, timeout=None):
+        query = """
+        MATCH (u:User {id: $uid})-[:EXPERIENCES]->(s:State)
+        RETURN s.name as state
+        """
+        states = [row['state'] for row in db.query(query, {'uid': user_id}, timeout=timeout)]
+        return self.neural.predict_cold_start(states, limit=limit) if states else []
+
+    def _remember(self, key, recs):
+        with self._lock:
+            self.last_good[key] = [dict(item) for item in recs]
+            self.last_good.move_to_end(key)
+            while len(self.last_good) > self.last_good_size:
+                self.last_good.popitem(last=False)
+
+    def map_attributes_to_states(self, attributes):
+        """
+        Map survey answers to the State nodes they indicate.
+        """
+        target_states = []
+        if attributes.get('growing_stress') == 'Yes':
+            target_states.append('Stress')
+        if attributes.get('mood_swings') in ['High', 'Medium']:
+            target_states.append('MoodSwings')
+        if attributes.get('social_weakness') == 'Yes':
+            target_states.append('SocialWeakness')
+        if attributes.get('coping_struggles') == 'Yes':
+            target_states.append('CopingIssues')
+        if attributes.get('work_interest') == 'No':
+            target_states.append('WorkBurnout')
+        return target_states
+
+    def get_recommendations(self, user_id=None, attributes=None, limit=5, strategy='hybrid', deadline=None):
         """
         Get recommendations based on:
         1. User ID (Graph traversal from User->State)
         2. Direct Attributes (Simulated State matching)
         3. Neural Match (if strategy='hybrid' or 'neural')
-        """
-        
-        neural_recs = []
-        if user_id and strategy in ['hybrid', 'neural']:
-            neural_recs = self.neural.predict(user_id, limit=limit)
-            if strategy == 'neural':
-                return neural_recs
 
-        graph_recs = []
+        Concurrent calls for the same user (or the same set of states), strategy
+        and limit are coalesced into a single computation.
+
+        With a deadline, a stage that overruns its budget is dropped and the
+        response degrades to the stages that finished (e.g. embedding-only),
+        or to the last complete result for the same request. A coalesced
+        caller waits for the leader only until its own deadline.
+        """
+        target_states = None
         if user_id:
-            # Logic: Find Activities that TREAT the States the User EXPERIENCES
-            query = """
-            MATCH (u:User {id: $uid})-[:EXPERIENCES]->(s:State)<-[:TREATS]-(a:Activity)
-            RETURN a.id as id, a.name as title, a.type as type, s.name as reason_category, 'Activity' as category
-            LIMIT $limit
-            """
-            graph_recs = db.query(query, {'uid': user_id, 'limit': limit})
-        
+            key = ('user', user_id, strategy, limit)
         elif attributes:
-            # Logic: Map input attributes to States, then find Activities
-            target_states = []
-            if attributes.get('growing_stress') == 'Yes':
-                target_states.append('Stress')
-            if attributes.get('mood_swings') in ['High', 'Medium']:
-                target_states.append('MoodSwings')
-            if attributes.get('social_weakness') == 'Yes':
-                target_states.append('SocialWeakness')
-            if attributes.get('coping_struggles') == 'Yes':
-                target_states.append('CopingIssues')
-            if attributes.get('work_interest') == 'No':
-                target_states.append('WorkBurnout')
-            
             # Fallback if no specific issues
-            if not target_states:
-                target_states.append('WellBeing')
+            target_states = self.map_attributes_to_states(attributes) or ['WellBeing']
+            key = ('states', frozenset(target_states), strategy, limit)
+        else:
+            return []
+
+        try:
+            recs = self.inflight.do(
+                key, lambda: self._compute_recommendations(key, user_id, target_states, limit, strategy, deadline),
+                timeout=deadline.remaining() if deadline is not None else None
+            )
+        except TimeoutError:
+            self.record('coalesced_timeout')
+            self.record('fallback_last_good')
+            with self._lock:
+                recs = self.last_good.get(key, [])
+        # Callers share the leader's result, so hand each one its own copies.
+        return [dict(item) for item in recs]
 
-            query = """
-            MATCH (s:State)<-[:TREATS]-(a:Activity)
-            WHERE s.name IN $states
-            RETURN a.id as id, a.name as title, a.type as type, s.name as reason_category, 'Activity' as category
-            LIMIT $limit
-            """
-            graph_recs = db.query(query, {'states': target_states, 'limit': limit})
+    def _compute_recommendations(self, key, user_id, target_states, limit, strategy, deadline):
+        graph_budget = self._stage_budget('graph', deadline)
+        wants_neural = strategy in ['hybrid', 'neural']
+        neural_skipped = False
+        if wants_neural and deadline is not None and not self.neural.loaded:
+            # Don't queue behind the warm-up thread's model load under a deadline
+            self.record('neural_not_ready')
+            wants_neural, neural_skipped = False, True
 
+        stages = {}
+        # Embedding scoring is in-memory, so it runs on the request thread
+        inline = ['neural']
+        if user_id:
+            if wants_neural and self.is_stale(user_id):
+                # Reads the user's current states from the graph first
+                neural_budget = self._stage_budget('neural', deadline)
+                stages['neural'] = lambda: self._predict_from_current_states(user_id, limit, neural_budget)
+                inline = []
+            elif wants_neural:
+                stages['neural'] = lambda: self.neural.predict(user_id, limit=limit)
+            if strategy != 'neural':
+                # Logic: Find Activities that TREAT the States the User EXPERIENCES
+                stages['graph'] = lambda: db.query(
+                    USER_GRAPH_QUERY, {'uid': user_id, 'limit': limit}, timeout=graph_budget)
+        else:
+            # Logic: Find Activities that TREAT the States mapped from the input attributes
+            stages['graph'] = lambda: db.query(
+                STATES_GRAPH_QUERY, {'states': target_states, 'limit': limit}, timeout=graph_budget)
             # NEURAL COLD START
-            if strategy in ['hybrid', 'neural']:
-                neural_recs = self.neural.predict_cold_start(target_states, limit=limit)
-            
-        # Combine and deduplicate
-        combined = []
-        seen = set()
-        
-        # Interleave results for hybrid feel (Graph, Neural, Graph, Neural...)
-        max_len = max(len(graph_recs), len(neural_recs))
-        for i in range(max_len):
-            if i < len(graph_recs):
-                item = graph_recs[i]
-                if item['id'] not in seen:
-                    combined.append(item)
-                    seen.add(item['id'])
-            
-            if i < len(neural_recs):
-                item = neural_recs[i]
-                if item['id'] not in seen:
-                    combined.append(item)
-                    seen.add(item['id'])
-                    
-        return combined[:limit]
+            if wants_neural:
+                stages['neural'] = lambda: self.neural.predict_cold_start(target_states, limit=limit)
+
+        results = self._run_stages(stages, deadline, inline)
+        if neural_skipped:
+            results['neural'] = None
+        failed = [name for name, result in results.items() if result is None]
+
+        if len(failed) == len(results):
+            self.record('fallback_last_good')
+            with self._lock:
+                return [dict(item) for item in self.last_good.get(key, [])]
+        if 'graph' in failed:
+            self.record('fallback_embedding_only')
+        if 'neural' in failed:
+            self.record('fallback_graph_only')
+
+        recs = interleave(results.get('graph') or [], results.get('neural') or [], limit)
+        if not failed:
+            self._remember(key, recs)
+        return recs
+
+    def explain_recommendations(self, item_ids, user_id, deadline=None):
+        """
+        Explanations for several recommended items in one query.
+        Returns {item_id: explanation}; falls back to a generic explanation
+        when the stage overruns its budget.
+        """
+        if not item_ids:
+            return {}
+        budget = self._stage_budget('explain', deadline)
+        query = """
+        MATCH (u:User {id: $uid})-[:EXPERIENCES]->(s:State)<-[:TREATS]-(a:Activity)
+        WHERE a.id IN $aids
+        RETURN a.id as id, s.name as state
+        """
+        rows = self._run_stages(
+            {'explain': lambda: db.query(query, {'uid': user_id, 'aids': list(item_ids)}, timeout=budget)},
+            deadline
+        )['explain']
+        if rows is None:
+            self.record('fallback_generic_explanation')
+            rows = []
+
+        states = {}
+        for row in rows:
+            states.setdefault(row['id'], row['state'])
+        return {item_id: self._explain_state(states.get(item_id)) for item_id in item_ids}
 
     def explain_recommendation(self, item_id, user_id):
         """
         Generate explanation: Why is this Activity recommended for this User?
         Path: (User)-[:EXPERIENCES]->(State)<-[:TREATS]-(Activity)
         """
-        query = """
-        MATCH (u:User {id: $uid})-[:EXPERIENCES]->(s:State)<-[:TREATS]-(a:Activity {id: $aid})
-        RETURN s.name as state
-        """
-        result = db.query(query, {'uid': user_id, 'aid': item_id})
-        
-        if result:
-            state = result[0]['state']
+        return self.explain_recommendations([item_id], user_id)[item_id]
+
+    def _explain_state(self, state):
+        if state:
             if state == 'Stress':
                 return "Recommended because you indicated signs of growing stress."
             elif state == 'MoodSwings':
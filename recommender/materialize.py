@@ -0,0 +1,63 @@
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph.db import db
+from recommender.engine import Recommender
+from recommender.store import RecommendationStore
+
+STRATEGIES = ['hybrid', 'graph', 'neural']
+
+def materialize(limit=5, strategies=STRATEGIES, batch_size=200):
+    """
+    Precompute recommendations and explanations for every User and write
+    them to the local store, tagged with the current embedding build.
+    Run after each graph build / embedding training.
+    """
+    store = RecommendationStore()
+    recommender = Recommender(lazy=True, store=store)
+    cached = recommender.warm_up()
+    build_version = recommender.neural.build_version
+    if not build_version:
+        print("No embeddings loaded; train them first (python ml/graph_embedding.py).")
+        return
+    if not cached:
+        # Neural results would all be empty and get stored for this build
+        print("Could not load the activity catalogue from Neo4j; aborting.")
+        return
+
+    user_ids = [row['id'] for row in db.query("MATCH (u:User) RETURN u.id as id")]
+    print(f"Materialising recommendations for {len(user_ids)} users (build {build_version})...")
+
+    rows = []
+    count = 0
+    for user_id in user_ids:
+        for strategy in strategies:
+            recs = recommender.get_recommendations(user_id=user_id, limit=limit, strategy=strategy)
+            explanations = recommender.explain_recommendations([item['id'] for item in recs], user_id)
+            payload = [{
+                'id': item['id'],
+                'title': item['title'],
+                'type': item['type'],
+                'category': item['category'],
+                'explanation': explanations[item['id']]
+            } for item in recs]
+            rows.append((user_id, strategy, limit, payload))
+
+        if len(rows) >= batch_size:
+            store.put_many(rows, build_version)
+            rows = []
+
+        count += 1
+        if count % 100 == 0:
+            print(f"Processed {count} users...")
+
+    if rows:
+        store.put_many(rows, build_version)
+    store.prune(build_version)
+    print("Materialisation complete.")
+
+if __name__ == "__main__":
+    materialize()
@@ -0,0 +1,54 @@
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key: the first caller (leader)
+    runs the function, every caller arriving while it is in flight waits
+    for and receives the leader's result instead of repeating the work.
+    A follower given a `timeout` stops waiting after that many seconds and
+    gets a TimeoutError; the leader carries on for the others.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {'executed': 0, 'coalesced': 0, 'timed_out': 0}
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self.stats['timed_out'] += 1
+                raise TimeoutError(f"Timed out waiting for in-flight call {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            # Forget the key before waking waiters so later requests start a
+            # fresh computation rather than reusing a completed one.
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
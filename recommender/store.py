@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+import threading
+
+class RecommendationStore:
+    """
+    Embedded SQLite store of precomputed recommendations (with explanations)
+    for known users. Every row is tagged with the embedding build version it
+    was computed from, so results from an older build are never served.
+    It also records which users' graph data changed after a build was
+    trained, so those marks survive restarts until the next build.
+    """
+    def __init__(self, path="data/recommendations.db"):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads, so each worker
+        # thread opens its own.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS recommendations (
+                user_id TEXT NOT NULL,
+                strategy TEXT NOT NULL,
+                max_items INTEGER NOT NULL,
+                build_version TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (user_id, strategy, max_items)
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS stale_users (
+                user_id TEXT PRIMARY KEY,
+                build_version TEXT NOT NULL
+            )
+            """)
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id, strategy, limit, build_version):
+        """
+        Return the stored response for this user, or None on a miss.
+        """
+        if not build_version:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT payload FROM recommendations "
+                "WHERE user_id = ? AND strategy = ? AND max_items = ? AND build_version = ?",
+                (user_id, strategy, limit, build_version)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Recommendation store read failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, rows, build_version):
+        """
+        Write (user_id, strategy, limit, payload) rows for a build version.
+        """
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO recommendations "
+                "(user_id, strategy, max_items, build_version, payload) VALUES (?, ?, ?, ?, ?)",
+                [(uid, strategy, limit, build_version, json.dumps(payload))
+                 for uid, strategy, limit, payload in rows]
+            )
+
+    def prune(self, build_version):
+        """
+        Drop rows computed from any other build. Stale marks are left to
+        the serving API, which clears them once it has loaded this build.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM recommendations WHERE build_version != ?", (build_version,))
+
+    def invalidate(self, user_ids):
+        """
+        Drop stored results for users whose graph data has changed.
+        """
+        conn = self._connection()
+        with conn:
+            conn.executemany("DELETE FROM recommendations WHERE user_id = ?",
+                             [(uid,) for uid in user_ids])
+
+    def mark_stale(self, user_ids, build_version):
+        """
+        Record that these users' graph data changed after `build_version`
+        was trained.
+        """
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO stale_users (user_id, build_version) VALUES (?, ?)",
+                             [(uid, build_version) for uid in user_ids])
+
+    def is_stale(self, user_id, build_version):
+        if not build_version:
+            return False
+        try:
+            row = self._connection().execute(
+                "SELECT 1 FROM stale_users WHERE user_id = ? AND build_version = ?",
+                (user_id, build_version)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Recommendation store read failed: {e}")
+            return False
+        return row is not None
+
+    def clear_stale(self, build_version):
+        """
+        Drop stale marks recorded against any build other than this one;
+        a newer build was trained on the changed data.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM stale_users WHERE build_version != ?", (build_version,))